@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
-import argparse, time, random, os, sys
+import argparse, asyncio, random, time, os, sys
 from typing import List, Dict, Tuple, Optional
+import aiohttp
+import orjson
 import pandas as pd
-from googleapiclient.discovery import build
 from dotenv import load_dotenv
 from tqdm import tqdm
 
@@ -12,28 +13,109 @@ EXTRA_COLUMNS = [
     'channel_id','channel_title','video_id','video_title','comment_id','author','is_reply'
 ]
 
-def build_youtube():
+COLUMNS = BASE_COLUMNS + EXTRA_COLUMNS
+
+API_URL = "https://www.googleapis.com/youtube/v3"
+
+MAX_WORKERS = 8
+
+# API pacing (calls/sec across all requests) and retries for 429/5xx and
+# rate-limit 403s, with exponential backoff between retries.
+API_RPS = 5.0
+API_RETRIES = 5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+QUOTA_REASONS = {'quotaExceeded', 'dailyLimitExceeded'}
+
+class QuotaExceeded(Exception):
+    pass
+
+class RateLimiter:
+    """
+    Token bucket for coroutines: on average `rps` acquisitions per second,
+    with bursts of up to `rps`. Waiters are served in arrival order.
+    """
+    def __init__(self, rps: float):
+        self.rps = rps
+        self.tokens = rps
+        self.ts = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rps, self.tokens + (now - self.ts) * self.rps)
+        self.ts = now
+
+    async def acquire(self):
+        async with self.lock:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rps)
+                self._refill()
+            self.tokens -= 1
+
+def error_reason(body: bytes) -> Optional[str]:
+    # reason code of a YouTube API error response, e.g. 'quotaExceeded'
+    try:
+        return orjson.loads(body)['error']['errors'][0].get('reason')
+    except (orjson.JSONDecodeError, KeyError, IndexError, TypeError):
+        return None
+
+class YouTubeAPI:
+    """
+    Minimal async client for the YouTube Data API v3 REST endpoints.
+    All calls share one aiohttp session, one rate limiter and the API key.
+    Once the daily quota is exhausted every further call raises QuotaExceeded
+    without touching the network.
+    """
+    def __init__(self, session: aiohttp.ClientSession, key: str, rps: float = API_RPS):
+        self.session = session
+        self.key = key
+        self.limiter = RateLimiter(rps)
+        self.quota_exceeded = False
+
+    async def get(self, path: str, **params) -> Dict:
+        params = params | {'key': self.key}
+        for attempt in range(API_RETRIES + 1):
+            if self.quota_exceeded:
+                raise QuotaExceeded(path)
+            await self.limiter.acquire()
+            async with self.session.get(f"{API_URL}/{path}", params=params) as resp:
+                if resp.status == 200:
+                    # orjson decodes the (often several-hundred-KB) pages much faster than json
+                    return orjson.loads(await resp.read())
+                reason = error_reason(await resp.read())
+                if resp.status == 403 and reason in QUOTA_REASONS:
+                    self.quota_exceeded = True
+                    raise QuotaExceeded(path)
+                retryable = resp.status in RETRY_STATUSES or \
+                            (resp.status == 403 and reason in RATE_LIMIT_REASONS)
+                if not retryable or attempt == API_RETRIES:
+                    resp.raise_for_status()
+            await asyncio.sleep(min(2 ** attempt, 60) + random.random())
+
+def load_api_key() -> str:
     load_dotenv()
     key = os.getenv("YT_API_KEY")
     if not key:
         print("[ERROR] YT_API_KEY not found. Create a .env with YT_API_KEY=...")
         sys.exit(1)
-    return build('youtube', 'v3', developerKey=key)
+    return key
 
-def search_videos(youtube, keywords: str, max_results: int = 50, order='relevance') -> List[Dict]:
+async def search_videos(api: YouTubeAPI, keywords: str, max_results: int = 50, order='relevance') -> List[Dict]:
     # returns search items for videos only
-    res = youtube.search().list(
-        q=keywords, part='snippet', type='video', maxResults=max_results, order=order
-    ).execute()
+    res = await api.get('search', q=keywords, part='snippet', type='video',
+                        maxResults=max_results, order=order)
     return res.get('items', [])
 
-def video_stats(youtube, video_ids: List[str]) -> Dict[str, Dict]:
+async def video_stats(api: YouTubeAPI, video_ids: List[str]) -> Dict[str, Dict]:
     out = {}
-    for i in range(0, len(video_ids), 50):
-        chunk = video_ids[i:i+50]
-        res = youtube.videos().list(
-            id=",".join(chunk), part='snippet,statistics'
-        ).execute()
+    # batches of 50 ids (the API maximum), fired concurrently
+    chunks = [video_ids[i:i+50] for i in range(0, len(video_ids), 50)]
+    responses = await asyncio.gather(*[
+        api.get('videos', id=",".join(chunk), part='snippet,statistics') for chunk in chunks
+    ])
+    for res in responses:
         for it in res.get('items', []):
             vid = it['id']
             stats = it.get('statistics', {})
@@ -47,14 +129,17 @@ def video_stats(youtube, video_ids: List[str]) -> Dict[str, Dict]:
             }
     return out
 
-def pick_5_channels_5_videos(youtube, keywords: str, min_comments: int = 25) -> List[Tuple[str, List[str]]]:
+async def pick_5_channels_5_videos(api: YouTubeAPI, keywords: str,
+                                   min_comments: int = 25) -> Tuple[List[Tuple[str, List[str]]], Dict[str, Dict]]:
     """
-    Returns list of tuples: (channelId, [video_ids...]) where each list has 5 videos
+    Returns (selected, stats): selected is a list of tuples (channelId, [video_ids...])
+    where each list has 5 videos, and stats maps every video id looked up to its
+    video_stats entry (so callers have titles without another videos.list call).
     Each candidate video must have >= min_comments (as reported by YouTube stats).
     """
-    items = search_videos(youtube, keywords, max_results=50, order='relevance')
+    items = await search_videos(api, keywords, max_results=50, order='relevance')
     video_ids = [it['id']['videoId'] for it in items]
-    stats = video_stats(youtube, video_ids)
+    stats = await video_stats(api, video_ids)
 
     # group by channel
     by_channel: Dict[str, List[str]] = {}
@@ -71,14 +156,15 @@ def pick_5_channels_5_videos(youtube, keywords: str, min_comments: int = 25) ->
     # select 5 channels that have 5 qualifying videos
     selected = [(ch, vids) for ch, vids in by_channel.items() if len(vids) == 5]
     if len(selected) >= 5:
-        return selected[:5]
+        return selected[:5], stats
 
     # If not enough, fetch more search pages (by switching order and keyword variants)
     variants = [order for order in ('viewCount','date','rating')]
     for ordv in variants:
-        items2 = search_videos(youtube, keywords, max_results=50, order=ordv)
+        items2 = await search_videos(api, keywords, max_results=50, order=ordv)
         video_ids2 = [it['id']['videoId'] for it in items2]
-        stats2 = video_stats(youtube, video_ids2)
+        stats2 = await video_stats(api, video_ids2)
+        stats.update(stats2)
         for vid, meta in stats2.items():
             if meta['commentCount'] >= min_comments:
                 ch = meta['channelId']
@@ -86,20 +172,42 @@ def pick_5_channels_5_videos(youtube, keywords: str, min_comments: int = 25) ->
                 if vid not in by_channel[ch]:
                     by_channel[ch].append(vid)
                     by_channel[ch] = sorted(by_channel[ch],
-                        key=lambda v: (stats.get(v, stats2.get(v))['commentCount']), reverse=True)[:5]
+                        key=lambda v: stats[v]['commentCount'], reverse=True)[:5]
         selected = [(ch, vids) for ch, vids in by_channel.items() if len(vids) == 5]
         if len(selected) >= 5:
-            return selected[:5]
+            return selected[:5], stats
 
     # final fallback: take top 5 channels with the most qualifying videos, pad with fewer if needed
     fallback = sorted(by_channel.items(), key=lambda kv: len(kv[1]), reverse=True)[:5]
-    return fallback
+    return fallback, stats
 
-def fetch_comments_for_video(youtube, video_id: str, target: int = 150) -> List[Dict]:
+def append_comment(buf: Dict[str, List], c: Dict, video_id: str, video_title: Optional[str],
+                   comment_id: str, parent_id: Optional[str] = None):
+    """
+    Append one comment (top-level or reply) to a column-wise buffer.
+    """
+    buf['title'].append(c.get('textDisplay', ''))
+    buf['link'].append(f"https://www.youtube.com/watch?v={video_id}&lc={comment_id}")
+    buf['date_published'].append(c.get('publishedAt'))
+    buf['text'].append(c.get('textOriginal', ''))
+    buf['like_count'].append(c.get('likeCount', 0))
+    buf['reply_parent_id'].append(parent_id)
+    buf['channel_id'].append(c.get('authorChannelId', {}).get('value'))
+    buf['channel_title'].append(c.get('authorDisplayName'))
+    buf['video_id'].append(video_id)
+    buf['video_title'].append(video_title)
+    buf['comment_id'].append(comment_id)
+    buf['author'].append(c.get('authorDisplayName'))
+    buf['is_reply'].append(parent_id is not None)
+
+async def fetch_comments_for_video(api: YouTubeAPI, video_id: str, title: Optional[str] = None,
+                                   target: int = 150) -> Dict[str, List]:
     """
     Fetch top-level comments and replies up to `target` rows (best-effort).
+    Rows come back column-wise ({column: [values...]}) so pd.DataFrame can
+    take them directly without building a dict per row.
     """
-    rows: List[Dict] = []
+    buf: Dict[str, List] = {col: [] for col in COLUMNS}
     next_page = None
     fetched = 0
 
@@ -107,46 +215,19 @@ def fetch_comments_for_video(youtube, video_id: str, target: int = 150) -> List[
         kwargs = dict(videoId=video_id, part='snippet,replies', maxResults=100, order='relevance')
         if next_page:
             kwargs['pageToken'] = next_page
-        resp = youtube.commentThreads().list(**kwargs).execute()
+        try:
+            resp = await api.get('commentThreads', **kwargs)
+        except QuotaExceeded:
+            print(f"[WARN] Quota exceeded; keeping {fetched} comments for {video_id}")
+            break
 
         for item in resp.get('items', []):
             top = item['snippet']['topLevelComment']
-            c = top['snippet']
-            # base + extras
-            rows.append({
-                'title': c.get('textDisplay', ''),
-                'link': f"https://www.youtube.com/watch?v={video_id}&lc={top['id']}",
-                'date_published': c.get('publishedAt'),
-                'text': c.get('textOriginal', ''),
-                'like_count': c.get('likeCount', 0),
-                'reply_parent_id': None,
-                'channel_id': c.get('authorChannelId', {}).get('value'),
-                'channel_title': c.get('authorDisplayName'),
-                'video_id': video_id,
-                'video_title': None,  # fill later
-                'comment_id': top['id'],
-                'author': c.get('authorDisplayName'),
-                'is_reply': False
-            })
+            append_comment(buf, top['snippet'], video_id, title, top['id'])
             fetched += 1
             # replies
             for reply in item.get('replies', {}).get('comments', []):
-                rc = reply['snippet']
-                rows.append({
-                    'title': rc.get('textDisplay', ''),
-                    'link': f"https://www.youtube.com/watch?v={video_id}&lc={reply['id']}",
-                    'date_published': rc.get('publishedAt'),
-                    'text': rc.get('textOriginal', ''),
-                    'like_count': rc.get('likeCount', 0),
-                    'reply_parent_id': top['id'],
-                    'channel_id': rc.get('authorChannelId', {}).get('value'),
-                    'channel_title': rc.get('authorDisplayName'),
-                    'video_id': video_id,
-                    'video_title': None,
-                    'comment_id': reply['id'],
-                    'author': rc.get('authorDisplayName'),
-                    'is_reply': True
-                })
+                append_comment(buf, reply['snippet'], video_id, title, reply['id'], parent_id=top['id'])
                 fetched += 1
 
             if fetched >= target:
@@ -158,30 +239,48 @@ def fetch_comments_for_video(youtube, video_id: str, target: int = 150) -> List[
         if not next_page:
             break
 
-        time.sleep(random.uniform(0.4, 0.8))
+    return buf
 
-    return rows
+def build_corpus_df(data: Dict[str, List]) -> pd.DataFrame:
+    # One constructor call from column lists; explicit columns= guarantees every
+    # column exists. Don't grow frames row by row or concat in a loop.
+    return pd.DataFrame(data, columns=COLUMNS)
 
-def fill_video_titles(youtube, rows: List[Dict]):
-    # collect unique video_ids
-    vids = sorted(set(r['video_id'] for r in rows if r['video_id']))
-    meta = {}
-    for i in range(0, len(vids), 50):
-        chunk = vids[i:i+50]
-        res = youtube.videos().list(id=",".join(chunk), part='snippet').execute()
-        for it in res.get('items', []):
-            meta[it['id']] = it['snippet'].get('title')
-    for r in rows:
-        if r['video_id'] in meta:
-            r['video_title'] = meta[r['video_id']]
-
-def build_corpus_df(rows: List[Dict]) -> pd.DataFrame:
-    base_df = pd.DataFrame(rows, columns=BASE_COLUMNS + EXTRA_COLUMNS)
-    # Ensure base columns are present even if extras are None
-    for col in BASE_COLUMNS:
-        if col not in base_df.columns:
-            base_df[col] = None
-    return base_df
+async def scrape(args, key: str) -> pd.DataFrame:
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=20, sock_read=60)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        api = YouTubeAPI(session, key)
+
+        # choose 5 channels × 5 videos (>= min comments)
+        selected, stats = await pick_5_channels_5_videos(api, args.keywords, min_comments=args.min_comments)
+        if len(selected) == 0:
+            print("[ERROR] No channels/videos found with the given constraints.")
+            sys.exit(2)
+
+        # Limit to requested number
+        selected = selected[:args.channels]
+        for ch, vids in selected:
+            if len(vids) > args.videos_per_channel:
+                vids[:] = vids[:args.videos_per_channel]
+
+        # fetch comments, several videos at a time
+        targets = [vid for _, vids in selected for vid in vids]
+        sem = asyncio.Semaphore(args.workers)
+        pbar = tqdm(total=len(targets), desc="Fetching video comments")
+
+        async def fetch_one(vid: str) -> Dict[str, List]:
+            async with sem:
+                buf = await fetch_comments_for_video(api, vid, title=stats[vid]['title'],
+                                                     target=args.target_per_video)
+            pbar.update(1)
+            return buf
+
+        # gather keeps results in selection order regardless of completion order
+        bufs = await asyncio.gather(*[fetch_one(vid) for vid in targets])
+        pbar.close()
+        all_columns = {col: [v for buf in bufs for v in buf[col]] for col in COLUMNS}
+
+        return build_corpus_df(all_columns)
 
 def main():
     ap = argparse.ArgumentParser()
@@ -191,41 +290,24 @@ def main():
     ap.add_argument("--min-comments", type=int, default=25, help="Minimum total comments a video must have to qualify")
     ap.add_argument("--target-per-video", type=int, default=150, help="Target number of comments to scrape per video")
     ap.add_argument("--out", default="youtube_comments.xlsx", help="Excel output path")
+    ap.add_argument("--workers", type=int, default=MAX_WORKERS, help="Videos to fetch comments for concurrently")
     args = ap.parse_args()
 
-    youtube = build_youtube()
-
-    # choose 5 channels × 5 videos (>= min comments)
-    selected = pick_5_channels_5_videos(youtube, args.keywords, min_comments=args.min_comments)
-    if len(selected) == 0:
-        print("[ERROR] No channels/videos found with the given constraints.")
-        sys.exit(2)
-
-    # Limit to requested number
-    selected = selected[:args.channels]
-    for ch, vids in selected:
-        if len(vids) > args.videos_per_channel:
-            vids[:] = vids[:args.videos_per_channel]
-
-    # fetch comments
-    all_rows: List[Dict] = []
-    pbar = tqdm(total=sum(len(v) for _, v in selected), desc="Fetching video comments")
-    for _, vids in selected:
-        for vid in vids:
-            rows = fetch_comments_for_video(youtube, vid, target=args.target_per_video)
-            all_rows.extend(rows)
-            pbar.update(1)
-            time.sleep(random.uniform(0.2, 0.5))
-    pbar.close()
-
-    # fill video titles
-    fill_video_titles(youtube, all_rows)
-
-    df = build_corpus_df(all_rows)
+    key = load_api_key()
+    try:
+        df = asyncio.run(scrape(args, key))
+    except QuotaExceeded:
+        print("[ERROR] YouTube API quota exceeded before any videos were selected.")
+        sys.exit(3)
 
     # Base sheet (exact columns required)
     base_df = df[['title','link','date_published','text','like_count','reply_parent_id']]
-    with pd.ExcelWriter(args.out, engine="openpyxl") as xw:
+    # strings_to_urls off: links stay plain text (as with openpyxl) and we avoid
+    # xlsxwriter's 65,530-hyperlinks-per-sheet limit. strings_to_formulas off:
+    # comments starting with "=" (e.g. "=))") must not become formulas that read back as 0
+    with pd.ExcelWriter(args.out, engine="xlsxwriter",
+                        engine_kwargs={"options": {"strings_to_urls": False,
+                                                   "strings_to_formulas": False}}) as xw:
         base_df.to_excel(xw, index=False, sheet_name="youtube_base")
         df.to_excel(xw, index=False, sheet_name="youtube_with_extras")
     print(f"[OK] Saved to {args.out}")
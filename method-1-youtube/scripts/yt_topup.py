@@ -1,4 +1,5 @@
-import os, time, random
+import os, json, time, threading
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from dotenv import load_dotenv
 from googleapiclient.discovery import build
@@ -10,12 +11,39 @@ KEYWORDS = "POGO Philippines Senate hearing Rappler"
 MIN_COMMENTS = 25
 TARGET_PER_VIDEO = 120
 OUT = "youtube_comments.xlsx"
+OUT_CACHE = OUT + ".parquet"   # columnar copy of the extras sheet, much faster to reload
+CHANNEL_CACHE = ".yt_channel_cache.json"   # channel name -> [channelId, channelTitle]
+MAX_WORKERS = 8
+API_RPS = 5.0      # calls/sec to googleapis.com, shared across threads
+API_RETRIES = 5    # googleapiclient retries 429/5xx with exponential backoff
 
 BASE_COLUMNS = ['title','link','date_published','text','like_count','reply_parent_id']
 EXTRA_COLUMNS = [
     'channel_id','channel_title','video_id','video_title','comment_id','author','is_reply',
     'video_uploader_channel_id','video_uploader_channel_title'
 ]
+COLUMNS = BASE_COLUMNS + EXTRA_COLUMNS
+TEXT_COLUMNS = [c for c in COLUMNS if c not in ('like_count','is_reply')]
+
+class RateLimiter:
+    # thread-safe token bucket, refilled at `rps` tokens/sec
+    def __init__(self, rps):
+        self.rps=rps; self.tokens=rps; self.ts=time.monotonic(); self.lock=threading.Lock()
+    def acquire(self):
+        while True:
+            with self.lock:
+                now=time.monotonic()
+                self.tokens=min(self.rps, self.tokens + (now-self.ts)*self.rps); self.ts=now
+                if self.tokens>=1:
+                    self.tokens-=1; return
+                wait=(1-self.tokens)/self.rps
+            time.sleep(wait)
+
+LIMITER = RateLimiter(API_RPS)
+
+def execute(req):
+    LIMITER.acquire()
+    return req.execute(num_retries=API_RETRIES)
 
 def yt():
     load_dotenv()
@@ -24,19 +52,40 @@ def yt():
         raise SystemExit("Set YT_API_KEY in .env or the environment first")
     return build('youtube','v3',developerKey=key)
 
+_local = threading.local()
+def thread_yt():
+    # googleapiclient clients aren't thread-safe; one per worker thread
+    if not hasattr(_local, 'y'): _local.y = yt()
+    return _local.y
+
+_channel_cache = None
+def channel_cache():
+    global _channel_cache
+    if _channel_cache is None:
+        _channel_cache = {}
+        if os.path.exists(CHANNEL_CACHE):
+            with open(CHANNEL_CACHE) as f: _channel_cache = json.load(f)
+    return _channel_cache
+
 def find_channel_id(y, name):
-    res = y.search().list(q=name, part='snippet', type='channel', maxResults=1).execute()
+    # search.list costs 100 quota units and channel ids don't change, so
+    # resolve each name once and remember it on disk across runs
+    cache = channel_cache()
+    if name in cache: return tuple(cache[name])
+    res = execute(y.search().list(q=name, part='snippet', type='channel', maxResults=1))
     items = res.get('items',[])
     if not items: return None, None
     ch = items[0]
-    return ch['snippet']['channelId'], ch['snippet']['channelTitle']
+    cache[name] = [ch['snippet']['channelId'], ch['snippet']['channelTitle']]
+    with open(CHANNEL_CACHE, 'w') as f: json.dump(cache, f, indent=2)
+    return tuple(cache[name])
 
 def video_stats(y, ids):
     out={}
     for i in range(0, len(ids), 50):
         chunk = ids[i:i+50]
         if not chunk: continue
-        res = y.videos().list(id=",".join(chunk), part='snippet,statistics').execute()
+        res = execute(y.videos().list(id=",".join(chunk), part='snippet,statistics'))
         for it in res.get('items',[]):
             out[it['id']] = {
                 'commentCount': int(it.get('statistics',{}).get('commentCount',0)),
@@ -47,84 +96,89 @@ def video_stats(y, ids):
     return out
 
 def search_channel_videos(y, channel_id, query, max_results=30):
-    res = y.search().list(q=query, channelId=channel_id, part='snippet', type='video',
-                          maxResults=max_results, order='viewCount').execute()
+    res = execute(y.search().list(q=query, channelId=channel_id, part='snippet', type='video',
+                                  maxResults=max_results, order='viewCount'))
     return [it['id']['videoId'] for it in res.get('items',[])]
 
+def append_comment(buf, c, video_id, comment_id, parent_id=None):
+    # one comment -> one value per column of the column-wise buffer
+    buf['title'].append(c.get('textDisplay',''))
+    buf['link'].append(f"https://www.youtube.com/watch?v={video_id}&lc={comment_id}")
+    buf['date_published'].append(c.get('publishedAt'))
+    buf['text'].append(c.get('textOriginal',''))
+    buf['like_count'].append(c.get('likeCount',0))
+    buf['reply_parent_id'].append(parent_id)
+    buf['channel_id'].append(c.get('authorChannelId',{}).get('value'))
+    buf['channel_title'].append(c.get('authorDisplayName'))
+    buf['video_id'].append(video_id)
+    buf['video_title'].append(None)
+    buf['comment_id'].append(comment_id)
+    buf['author'].append(c.get('authorDisplayName'))
+    buf['is_reply'].append(parent_id is not None)
+    buf['video_uploader_channel_id'].append(None)
+    buf['video_uploader_channel_title'].append(None)
+
 def fetch_comments(y, video_id, target=TARGET_PER_VIDEO):
-    rows=[]; nextp=None; got=0
+    buf={col: [] for col in COLUMNS}; nextp=None; got=0
     while True:
         kw = dict(videoId=video_id, part='snippet,replies', maxResults=100, order='relevance')
         if nextp: kw['pageToken']=nextp
-        resp = y.commentThreads().list(**kw).execute()
+        resp = execute(y.commentThreads().list(**kw))
         for item in resp.get('items',[]):
-            top=item['snippet']['topLevelComment']; c=top['snippet']
-            rows.append({
-                'title': c.get('textDisplay',''),
-                'link': f"https://www.youtube.com/watch?v={video_id}&lc={top['id']}",
-                'date_published': c.get('publishedAt'),
-                'text': c.get('textOriginal',''),
-                'like_count': c.get('likeCount',0),
-                'reply_parent_id': None,
-                'channel_id': c.get('authorChannelId',{}).get('value'),
-                'channel_title': c.get('authorDisplayName'),
-                'video_id': video_id,
-                'video_title': None,
-                'comment_id': top['id'],
-                'author': c.get('authorDisplayName'),
-                'is_reply': False
-            }); got+=1
+            top=item['snippet']['topLevelComment']
+            append_comment(buf, top['snippet'], video_id, top['id']); got+=1
             for reply in item.get('replies',{}).get('comments',[]):
-                rc=reply['snippet']
-                rows.append({
-                    'title': rc.get('textDisplay',''),
-                    'link': f"https://www.youtube.com/watch?v={video_id}&lc={reply['id']}",
-                    'date_published': rc.get('publishedAt'),
-                    'text': rc.get('textOriginal',''),
-                    'like_count': rc.get('likeCount',0),
-                    'reply_parent_id': top['id'],
-                    'channel_id': rc.get('authorChannelId',{}).get('value'),
-                    'channel_title': rc.get('authorDisplayName'),
-                    'video_id': video_id,
-                    'video_title': None,
-                    'comment_id': reply['id'],
-                    'author': rc.get('authorDisplayName'),
-                    'is_reply': True
-                }); got+=1
+                append_comment(buf, reply['snippet'], video_id, reply['id'], parent_id=top['id']); got+=1
             if got>=target: break
         if got>=target: break
         nextp = resp.get('nextPageToken')
         if not nextp: break
-        time.sleep(random.uniform(0.3,0.6))
-    return rows
-
-def fill_video_meta(y, rows):
-    vids = sorted(set(r['video_id'] for r in rows if r.get('video_id')))
-    meta = video_stats(y, vids)
-    for r in rows:
-        m = meta.get(r['video_id'])
-        if m:
-            r['video_title'] = m['title']
-            r['video_uploader_channel_id'] = m['channelId']
-            r['video_uploader_channel_title'] = m['channelTitle']
+    return buf
+
+META_COLUMNS = ['video_title','video_uploader_channel_id','video_uploader_channel_title']
+
+def fill_video_meta(df, meta):
+    # meta: video id -> video_stats entry, already fetched when picking videos
+    # (nothing to fill, e.g. every channel already had its videos; an empty
+    # column-wise frame is float64 and can't be joined on video_id)
+    if df.empty or not meta: return df
+    meta_df = pd.DataFrame(
+        [(v, m['title'], m['channelId'], m['channelTitle']) for v, m in meta.items()],
+        columns=['video_id'] + META_COLUMNS,
+    ).set_index('video_id')
+    # single join against the per-video meta instead of a per-row loop
+    df = df.join(meta_df, on='video_id', rsuffix='_m')
+    for col in META_COLUMNS:
+        df[col] = df[col + '_m'].combine_first(df[col])
+    return df.drop(columns=[col + '_m' for col in META_COLUMNS])
+
+def as_text(df):
+    # read_excel can hand back ints in text columns (e.g. a cell stored as a
+    # formula reads as 0); pin them to str so parquet gets one type per column
+    return df.astype({c: 'string' for c in TEXT_COLUMNS})
+
+def load_existing():
+    # prefer the parquet cache unless the workbook was rewritten after it
+    if os.path.exists(OUT_CACHE) and os.path.exists(OUT) \
+            and os.path.getmtime(OUT_CACHE) >= os.path.getmtime(OUT):
+        df = pd.read_parquet(OUT_CACHE)
+    elif os.path.exists(OUT):
+        df = pd.read_excel(OUT, sheet_name='youtube_with_extras')
+    else:
+        df = pd.DataFrame(columns=COLUMNS)
+    return as_text(df.reindex(columns=COLUMNS))
 
 def main():
     y = yt()
-    existing = []
-    if os.path.exists(OUT):
-        df = pd.read_excel(OUT, sheet_name='youtube_with_extras')
-        existing = df.to_dict('records')
-    existing_vids = set(r.get('video_id') for r in existing if r.get('video_id'))
+    existing_df = load_existing()
+    existing_vids = set(existing_df['video_id'].dropna())
 
     # Count per uploader channel from existing
-    per_ch = {}
-    for r in existing:
-        ch = r.get('video_uploader_channel_id') or r.get('channel_id')
-        vid = r.get('video_id')
-        if ch and vid:
-            per_ch.setdefault(ch, set()).add(vid)
-
-    added=[]
+    ch = existing_df['video_uploader_channel_id'].fillna(existing_df['channel_id'])
+    pairs = pd.DataFrame({'ch': ch, 'vid': existing_df['video_id']}).dropna()
+    per_ch = pairs.groupby('ch')['vid'].apply(set).to_dict()
+
+    jobs=[]; picked_meta={}
     for name in TARGET_CHANNEL_NAMES:
         ch_id, ch_title = find_channel_id(y, name)
         if not ch_id: continue
@@ -138,22 +192,28 @@ def main():
         cand.sort(key=lambda v: meta[v]['commentCount'], reverse=True)
         pick = cand[:need]
         for vid in pick:
-            rows = fetch_comments(y, vid, target=TARGET_PER_VIDEO)
-            fill_video_meta(y, rows)
-            for r in rows:
-                m = meta[vid]
-                r['video_uploader_channel_id'] = m['channelId']
-                r['video_uploader_channel_title'] = m['channelTitle']
-            added.extend(rows)
+            jobs.append(vid); picked_meta[vid]=meta[vid]
             existing_vids.add(vid)
             per_ch.setdefault(ch_id, set()).add(vid)
 
-    all_rows = existing + added
-    df = pd.DataFrame(all_rows, columns=BASE_COLUMNS + EXTRA_COLUMNS)
+    # fetch comments for all picked videos concurrently; map() keeps job order
+    added={col: [] for col in COLUMNS}
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        for buf in ex.map(lambda vid: fetch_comments(thread_yt(), vid, target=TARGET_PER_VIDEO), jobs):
+            for col in COLUMNS: added[col].extend(buf[col])
+    added_df = fill_video_meta(pd.DataFrame(added, columns=COLUMNS), picked_meta)
+
+    df = pd.concat([existing_df, added_df], ignore_index=True) if len(added_df) else existing_df
     base = df[['title','link','date_published','text','like_count','reply_parent_id']]
-    with pd.ExcelWriter(OUT, engine='openpyxl') as xw:
+    with pd.ExcelWriter(OUT, engine='xlsxwriter',
+                        engine_kwargs={'options': {'strings_to_urls': False,
+                                                   'strings_to_formulas': False}}) as xw:
         base.to_excel(xw, index=False, sheet_name='youtube_base')
         df.to_excel(xw, index=False, sheet_name='youtube_with_extras')
+    try:
+        as_text(df).to_parquet(OUT_CACHE, index=False)
+    except Exception as e:
+        print(f"[WARN] Could not write parquet cache {OUT_CACHE}: {e}")
     print("[OK] Topped up. Videos now:", df['video_id'].nunique())
 
 if __name__ == "__main__":